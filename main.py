@@ -11,31 +11,53 @@
 - 著者名は姓のみ（"Last, First"→カンマ前／それ以外→最後の語）
 """
 
-import os, re, time, json, textwrap, datetime as dt
-import requests, feedparser, yaml
+import os, re, io, time, json, collections, functools, operator, datetime as dt
+import xml.etree.ElementTree as ET
+import requests, yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from zoneinfo import ZoneInfo
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 from reportlab.lib.units import mm
-from reportlab.lib.colors import Color
+from reportlab.lib.colors import Color, black
 
 ARXIV_API = "https://export.arxiv.org/api/query"  # 公式API（Atom）
 JST = ZoneInfo("Asia/Tokyo")
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+# 前回の取得結果（条件付き取得用）
+META_PATH = os.path.join("out", ".arxiv_meta.json")
+ENTRIES_PATH = os.path.join("out", ".arxiv_entries.json")
+# parse_atom の出力形式を変えたら上げる（古い形式のキャッシュは使わない）
+CACHE_FORMAT = 1
 
 # User-Agent: arXivへの礼儀として連絡先（メール等）を含める
 CONTACT = os.environ.get("ARXIV_CONTACT", "contact@example.com")
 HEADERS = {"User-Agent": f"ag-weekly-bot (contact: {CONTACT})"}
 
+# 一時的なエラー・429 は間隔を空けて再試行
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(
+    max_retries=Retry(total=3, backoff_factor=1.0, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
 #TITLE_COLOR = Color(232/255.0, 180/255.0, 180/255.0)  # RGB(232,180,180)
 TITLE_COLOR = Color(212/255.0, 201/255.0, 215/255.0)  # RGB(212,201,215)
 
+# CJKフォント（CID）は import 時に1度だけ登録
+FONT = 'HeiseiKakuGo-W5'
+if FONT not in pdfmetrics.getRegisteredFontNames():
+    pdfmetrics.registerFont(UnicodeCIDFont(FONT))
+
 def load_config(path="config.yaml"):
     with open(path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
-def arxiv_query_math_ag(max_results=2000, start=0, sortBy="submittedDate", sortOrder="descending"):
+def arxiv_query_math_ag(max_results=2000, start=0, sortBy="submittedDate", sortOrder="descending", headers=None):
     params = {
         "search_query": "cat:math.AG",
         "start": start,
@@ -43,116 +65,202 @@ def arxiv_query_math_ag(max_results=2000, start=0, sortBy="submittedDate", sortO
         "sortBy": sortBy,
         "sortOrder": sortOrder,
     }
-    r = requests.get(ARXIV_API, params=params, headers=HEADERS, timeout=60)
+    r = SESSION.get(ARXIV_API, params=params, headers=headers, timeout=60)
     r.raise_for_status()
-    return r.text  # XML(Atom)
+    return r  # r.content が XML(Atom)。条件付き要求なら 304（本文なし）もありうる
+
+def _load_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_json(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+def fetch_entries(max_results=2000):
+    """ 前回と同じ問い合わせなら ETag / Last-Modified で条件付き取得し、304 なら前回の解析結果を使う """
+    meta = _load_json(META_PATH) or {}
+    same_query = meta.get("format") == CACHE_FORMAT and meta.get("max_results") == max_results
+    cached = _load_json(ENTRIES_PATH) if same_query else None
+    headers = {}
+    if cached is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    r = arxiv_query_math_ag(max_results=max_results, headers=headers)
+    if r.status_code == 304 and cached is not None:
+        return cached
+
+    entries = parse_atom(r.content)
+    _save_json(ENTRIES_PATH, entries)
+    _save_json(META_PATH, {
+        "format": CACHE_FORMAT,
+        "max_results": max_results,
+        "etag": r.headers.get("ETag"),
+        "last_modified": r.headers.get("Last-Modified"),
+    })
+    return entries
+
+def parse_atom(xml):
+    # arXiv API は単一の Atom 形式のみ返すので、汎用パーサを使わず entry を直接読む
+    # xml はレスポンスのバイト列のまま渡す（文字コードは XML 宣言に従う）
+    def text(el, tag):
+        t = el.findtext(ATOM + tag)
+        return t.strip() if t else ""
 
-def parse_atom(xml_text):
-    feed = feedparser.parse(xml_text)
     entries = []
-    for e in feed.entries:
-        links = {ln.get("title",""): ln["href"] for ln in e.links}
-        pdf_url = links.get("pdf") or next((ln["href"] for ln in e.links if ln.get("type")=="application/pdf"), None)
-        entries.append({
-            "id": e.get("id"),
-            "title": e.get("title","").strip(),
-            "summary": e.get("summary","").strip(),
-            "authors": [a.get("name","") for a in e.get("authors",[])],
-            "published": e.get("published"),
-            "updated": e.get("updated"),
-            "categories": [t.get("term") for t in e.get("tags",[]) if t.get("term")],
-            "abs_url": e.get("id"),
+    for _, e in ET.iterparse(io.BytesIO(xml), events=("end",)):
+        if e.tag != ATOM + "entry":
+            continue
+        links = e.findall(ATOM + "link")
+        pdf_url = next((ln.get("href") for ln in links if ln.get("title") == "pdf"), None) \
+            or next((ln.get("href") for ln in links if ln.get("type") == "application/pdf"), None)
+        entry = {
+            "id": e.findtext(ATOM + "id"),
+            "title": text(e, "title"),
+            "summary": text(e, "summary"),
+            "authors": [a.findtext(ATOM + "name", "") for a in e.findall(ATOM + "author")],
+            "published": e.findtext(ATOM + "published"),
+            "updated": e.findtext(ATOM + "updated"),
+            "categories": [c.get("term") for c in e.findall(ATOM + "category") if c.get("term")],
+            "abs_url": e.findtext(ATOM + "id"),
             "pdf_url": pdf_url,
-        })
+        }
+        # スコアリング用の小文字化済み文字列（タイトル, 要旨, カテゴリ, 著者）
+        entry["_lc"] = (
+            entry["title"].lower(),
+            entry["summary"].lower(),
+            " ".join(entry["categories"]).lower(),
+            " ".join(entry["authors"]).lower(),
+        )
+        entries.append(entry)
+        e.clear()  # 読み終えた entry は解放
     return entries
 
-def in_lookback(e, days):
-    def parse_iso(s):
-        try:
-            return dt.datetime.fromisoformat(s.replace("Z","+00:00"))
-        except Exception:
-            return None
-    cand = max([d for d in [parse_iso(e.get("updated","")), parse_iso(e.get("published",""))] if d], default=None)
-    if not cand:
-        return True
-    now = dt.datetime.now(dt.timezone.utc)
-    return (now - cand).days <= days
+def lookback_cutoff(days):
+    # (now - t).days <= days  ⇔  t > now - (days+1)日。arXiv の日時は固定書式なので文字列のまま比較できる
+    cutoff = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=days + 1)
+    return cutoff.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def score_entry(e, cfg):
+def in_lookback(e, cutoff):
+    s = max(e.get("updated") or "", e.get("published") or "")
+    if not s:
+        return True
+    return s > cutoff
+
+# 採点用に前処理した設定（語は小文字化、重みは欄ごとの係数を掛けた値）
+Profile = collections.namedtuple("Profile", ["keywords", "authors", "msc", "exclude"])
+
+def compile_profile(cfg):
+    """ config の profile / scoring から Profile を作る（1回の実行につき1度だけ） """
+    prof, sc = cfg["profile"], cfg["scoring"]
+    tw, aw = sc.get("title_weight",1.0), sc.get("abstract_weight",1.0)
+    auw, cw = sc.get("author_weight",1.0), sc.get("category_weight",0.5)
+    keywords = tuple((kw["term"].lower(), kw.get("weight",1) * tw, kw.get("weight",1) * aw) for kw in prof.get("keywords", []))
+    authors  = tuple((au["name"].lower(), au.get("weight",1) * auw) for au in prof.get("authors_priority", []))
+    msc      = tuple((ms["term"].lower(), ms.get("weight",1) * cw) for ms in prof.get("msc_terms", []))
+    exclude  = tuple(bad.lower() for bad in prof.get("exclude", []))
+    return Profile(keywords, authors, msc, exclude)
+
+def score_entry(e, profile):
     score = 0.0
-    title = e["title"].lower()
-    abstr = e["summary"].lower()
-    cats  = " ".join(e["categories"]).lower()
-    authors = " ".join(e["authors"]).lower()
-
-    for kw in cfg["profile"].get("keywords", []):
-        term = kw["term"].lower()
-        w = kw.get("weight",1)
-        if term in title:  score += w * cfg["scoring"].get("title_weight",1.0)
-        if term in abstr:  score += w * cfg["scoring"].get("abstract_weight",1.0)
-    for au in cfg["profile"].get("authors_priority", []):
-        if au["name"].lower() in authors:
-            score += au.get("weight",1) * cfg["scoring"].get("author_weight",1.0)
-    for ms in cfg["profile"].get("msc_terms", []):
-        if ms["term"].lower() in cats:
-            score += ms.get("weight",1) * cfg["scoring"].get("category_weight",0.5)
-
-    for bad in cfg["profile"].get("exclude", []):
-        if bad.lower() in title or bad.lower() in abstr:
+    title, abstr, cats, authors = e["_lc"]
+
+    for term, w_title, w_abs in profile.keywords:
+        if term in title:  score += w_title
+        if term in abstr:  score += w_abs
+    for name, w in profile.authors:
+        if name in authors:
+            score += w
+    for term, w in profile.msc:
+        if term in cats:
+            score += w
+
+    for bad in profile.exclude:
+        if bad in title or bad in abstr:
             score -= 2.0
 
     return score
 
 # --- 著者表記（姓のみ）ユーティリティ ------------------------------
 
+# "Last, First" はカンマ前、それ以外は最後の語
+_SURNAME_RE = re.compile(r"^\s*([^,]*?)\s*,|(\S+)\s*$")
+_STRIP_PUNCT = str.maketrans("", "", "\\.,")
+
 def _surname_from_name(name: str) -> str:
     """ 'Last, First Middle' → 'Last' / 'First Middle Last' → 'Last' """
-    name = name.strip()
-    if not name:
+    m = _SURNAME_RE.search(name)
+    if not m:
         return ""
-    # “Last, First ...” 形式はカンマ前を姓とみなす
-    if "," in name:
-        last = name.split(",")[0].strip()
-    else:
-        parts = name.split()
-        last = parts[-1] if parts else name
+    last = m.group(1) if m.group(1) is not None else m.group(2)
     # 記号の除去（. ,）
-    last = re.sub(r"[\\.,]", "", last)
-    return last
+    return last.translate(_STRIP_PUNCT)
 
 def surnames_only(authors_list):
     # 著者配列を姓配列に変換（重複はそのまま／順序保持）
-    return [_surname_from_name(a) for a in authors_list if a and _surname_from_name(a)]
+    return [s for a in authors_list if a and (s := _surname_from_name(a))]
 
 # --- PDF 出力 -------------------------------------------------------
 
+@functools.lru_cache(maxsize=None)
+def _char_width(ch, size):
+    # 1文字ごとの幅（pt）は1度だけ問い合わせて使い回す
+    return pdfmetrics.stringWidth(ch, FONT, size)
+
+def wrap_by_width(s, max_w, size):
+    """ 実際の文字幅で貪欲に折り返す（語の途中では切らず、1行に収まらない語だけ文字単位で切る） """
+    lines, cur, w = [], [], 0.0
+    space = _char_width(" ", size)
+    for word in s.split():
+        ww = sum(_char_width(ch, size) for ch in word)
+        if cur and w + space + ww <= max_w:
+            cur += [" ", word]; w += space + ww
+            continue
+        if ww <= max_w:
+            if cur:
+                lines.append("".join(cur))
+            cur, w = [word], ww
+            continue
+        # 長い URL や空白のない和文などは、今の行に続けて文字単位で切る
+        if cur:
+            cur.append(" "); w += space
+        for ch in word:
+            cw = _char_width(ch, size)
+            if cur and w + cw > max_w:
+                lines.append("".join(cur).rstrip()); cur, w = [], 0.0
+            cur.append(ch); w += cw
+    if cur:
+        lines.append("".join(cur))
+    return lines
+
 def build_pdf(filename, title, items):
     os.makedirs("out", exist_ok=True)
     path = os.path.join("out", filename)
 
-    # CJKフォント（CID）
-    pdfmetrics.registerFont(UnicodeCIDFont('HeiseiKakuGo-W5'))
-
     c = canvas.Canvas(path, pagesize=A4)
     c.setTitle(title)
     width, height = A4
+    margin = 20*mm
 
-    def draw_wrapped(x, y, s, size=12, leading=16, wrap=84, color=None):
-        c.setFont('HeiseiKakuGo-W5', size)
-        if color:
-            c.setFillColor(color)
-        else:
-            c.setFillColorRGB(0,0,0)
-        for line in textwrap.wrap(s, width=wrap):
-            c.drawString(x, y, line)
-            y -= leading
-        # 戻す
-        c.setFillColorRGB(0,0,0)
-        return y
+    def draw_wrapped(x, y, s, size=12, leading=16, color=None):
+        # 1ブロック＝1つのテキストオブジェクト（BT…ET）。フォント・色も1度だけ設定
+        to = c.beginText(x, y)
+        to.setFont(FONT, size, leading)
+        to.setFillColor(color or black)
+        for line in wrap_by_width(s, width - x - margin, size):
+            to.textLine(line)
+        c.drawText(to)
+        return to.getY()
 
-    margin = 20*mm
     y = height - margin
-    y = draw_wrapped(margin, y, title, size=16, leading=20, wrap=60) - 8
+    y = draw_wrapped(margin, y, title, size=16, leading=20) - 8
 
     if not items:
         y = draw_wrapped(margin, y, "今週のピックアップは 0件 でした。")
@@ -160,7 +268,7 @@ def build_pdf(filename, title, items):
 
     for i, e in enumerate(items, 1):
         # タイトル（色付き）
-        y = draw_wrapped(margin, y, f"[{i}] {e['title']}", size=13, leading=18, wrap=70, color=TITLE_COLOR) - 2
+        y = draw_wrapped(margin, y, f"[{i}] {e['title']}", size=13, leading=18, color=TITLE_COLOR) - 2
         # 著者（姓のみ）
         surnames = surnames_only(e["authors"])
         y = draw_wrapped(margin, y, f"著者: {', '.join(surnames)}")
@@ -179,19 +287,20 @@ def main():
     cfg = load_config()
 
     # 1) arXivから取得（最大 max_fetch、最新順）
-    xml = arxiv_query_math_ag(max_results=cfg["limits"]["max_fetch"])
-    entries = [e for e in parse_atom(xml) if in_lookback(e, cfg["limits"]["lookback_days"])]
+    cutoff = lookback_cutoff(cfg["limits"]["lookback_days"])
+    entries = [e for e in fetch_entries(max_results=cfg["limits"]["max_fetch"]) if in_lookback(e, cutoff)]
 
     # 2) スコアリング → しきい値以上のみ
+    profile = compile_profile(cfg)
     picked = []
     for e in entries:
-        s = score_entry(e, cfg)
+        s = score_entry(e, profile)
         if s >= cfg["scoring"]["threshold"]:
             e["score"] = s
             picked.append(e)
 
     # 3) スコア（重み）降順で掲載
-    picked.sort(key=lambda x: x["score"], reverse=True)
+    picked.sort(key=operator.itemgetter("score"), reverse=True)
 
     # 4) PDF生成
     today = dt.datetime.now(JST).strftime("%Y-%m-%d")